@@ -1,291 +1,1118 @@
-import streamlit as st
-import tempfile
-import subprocess
-import os
-
-# Configure Streamlit
-st.set_page_config(
-    page_title="Video Shrinker", 
-    layout="centered"
-)
-
-st.title("📹 Video Shrinker (using FFmpeg)")
-st.markdown("Upload a video (up to 1GB), choose compression settings, and download a smaller version.")
-
-uploaded = st.file_uploader(
-    "Upload a video file (Max: 1GB)",
-    type=["mp4", "mov", "avi", "mkv", "webm", "flv", "wmv", "m4v"],
-    accept_multiple_files=False,
-    help="Supported formats: MP4, MOV, AVI, MKV, WebM, FLV, WMV, M4V"
-)
-
-if uploaded is not None:
-    file_size_mb = uploaded.size / 1024 / 1024
-    st.write(f"**Uploaded file:** {uploaded.name}")
-    st.write(f"**Format:** {uploaded.type}")
-    st.write(f"**Size:** {file_size_mb:.2f} MB")
-    
-    if file_size_mb > 500:
-        st.warning("⚠️ Large file detected. Compression may take several minutes.")
-    
-    st.sidebar.header("🎛️ Compression Settings")
-    
-    quality_preset = st.sidebar.selectbox(
-        "Quality Preset",
-        options=["Custom", "High Quality", "Balanced", "Small Size"],
-        index=2,
-        help="Quick presets for common use cases"
-    )
-    
-    if quality_preset == "High Quality":
-        default_crf, default_audio = 20, "192k"
-    elif quality_preset == "Balanced":
-        default_crf, default_audio = 23, "128k"
-    elif quality_preset == "Small Size":
-        default_crf, default_audio = 28, "96k"
-    else:
-        default_crf, default_audio = 23, "128k"
-    
-    crf_value = st.sidebar.slider(
-        "CRF (Constant Rate Factor)",
-        min_value=15, max_value=35, value=default_crf, step=1,
-        help="Lower CRF = higher quality but larger file. Higher CRF = smaller file but lower quality."
-    )
-    
-    resolution_option = st.sidebar.selectbox(
-        "Resolution",
-        options=["Keep Original", "1920x1080 (1080p)", "1280x720 (720p)", "854x480 (480p)", "Custom"],
-        index=0
-    )
-    
-    scale_width = 0
-    if resolution_option == "1920x1080 (1080p)":
-        scale_width = 1920
-    elif resolution_option == "1280x720 (720p)":
-        scale_width = 1280
-    elif resolution_option == "854x480 (480p)":
-        scale_width = 854
-    elif resolution_option == "Custom":
-        scale_width = st.sidebar.number_input(
-            "Max width (px)", min_value=0, value=0, step=100,
-            help="Leave 0 to keep original resolution."
-        )
-    
-    audio_bitrate = st.sidebar.selectbox(
-        "Audio Bitrate",
-        options=["192k", "128k", "96k", "64k"],
-        index=["192k", "128k", "96k", "64k"].index(default_audio),
-        help="Lower audio bitrate reduces file size but may affect audio quality."
-    )
-    
-    with st.sidebar.expander("🔧 Advanced Options"):
-        video_codec = st.selectbox(
-            "Video Codec",
-            options=["libx264", "libx265"],
-            index=0,
-            help="H.265 (libx265) provides better compression but slower encoding"
-        )
-        
-        framerate_limit = st.number_input(
-            "Max Frame Rate (fps)",
-            min_value=0, max_value=60, value=0, step=1,
-            help="Leave 0 to keep original framerate"
-        )
-
-if uploaded is not None and st.button("🚀 Compress Video", type="primary"):
-    try:
-        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True, text=True)
-        st.success("✅ FFmpeg detected successfully!")
-        st.write("FFmpeg version:", result.stdout.split('\n')[0])
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        st.error("❌ FFmpeg is not installed or not found in system PATH.")
-        
-        st.write("**Debug Info:**")
-        st.write("Error:", str(e))
-        
-        # Updated lookup paths
-        common_paths = [
-            # ← Update this to the exact location you verified:
-            r"C:\Users\rannandale\OneDrive\Coding\video-shrinker\ffmpeg-master-latest-win64-gpl\bin\ffmpeg.exe",
-            r"C:\ffmpeg\bin\ffmpeg.exe",
-            "ffmpeg.exe",
-            "ffmpeg"
-        ]
-        
-        for path in common_paths:
-            if os.path.exists(path):
-                st.write(f"✅ Found FFmpeg at: {path}")
-            else:
-                st.write(f"❌ Not found at: {path}")
-        
-        path_env = os.environ.get('PATH', '')
-        st.write("Current PATH contains:")
-        for path_part in path_env.split(os.pathsep):
-            if 'ffmpeg' in path_part.lower():
-                st.write(f"🎯 {path_part}")
-        
-        st.info("""
-        **Quick fixes to try:**
-        
-        1. **Restart Streamlit completely:**
-           - Stop the app (Ctrl+C)
-           - Close terminal
-           - Open new Command Prompt
-           - Run: `streamlit run app.py`
-        
-        2. **Try running from the directory where ffmpeg.exe is located**
-        
-        3. **Use absolute path test:**
-           - Run: `C:\\Users\\rannandale\\OneDrive\\Coding\\video-shrinker\\ffmpeg-master-latest-win64-gpl\\bin\\ffmpeg.exe -version`
-        """)
-        
-        demo_mode = st.checkbox("🧪 Enable Demo Mode (simulates compression without FFmpeg)")
-        if not demo_mode:
-            st.stop()
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    try:
-        input_suffix = os.path.splitext(uploaded.name)[1] or '.mp4'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=input_suffix) as in_tmp:
-            in_tmp.write(uploaded.getvalue())
-            in_tmp.flush()
-            in_path = in_tmp.name
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as out_tmp:
-            out_path = out_tmp.name
-        
-        if not os.path.exists(in_path) or os.path.getsize(in_path) == 0:
-            st.error("❌ Failed to create temporary input file")
-        else:
-            status_text.text("🔄 Starting compression...")
-            progress_bar.progress(10)
-            
-            cmd = [
-                "ffmpeg", "-y", "-i", in_path,
-                "-vcodec", video_codec,
-                "-crf", str(crf_value),
-                "-acodec", "aac",
-                "-b:a", audio_bitrate,
-                "-movflags", "+faststart"
-            ]
-            
-            video_filters = []
-            if scale_width and scale_width > 0:
-                video_filters.append(f"scale='min({scale_width},iw)':'-2'")
-            if framerate_limit and framerate_limit > 0:
-                video_filters.append(f"fps=fps='min({framerate_limit},source_fps)'")
-            
-            if video_filters:
-                cmd += ["-vf", ",".join(video_filters)]
-            
-            cmd.append(out_path)
-            
-            st.write("Debug - FFmpeg command:", " ".join(cmd))
-            
-            if 'demo_mode' in locals() and demo_mode:
-                progress_bar.progress(50)
-                status_text.text("🧪 Demo mode: Simulating compression...")
-                import time
-                time.sleep(2)
-                
-                with open(out_path, 'wb') as f:
-                    f.write(b"Demo compressed video file")
-                
-                progress_bar.progress(100)
-                status_text.text("✅ Demo compression completed!")
-                
-                original_size = uploaded.size / 1024 / 1024
-                simulated_compressed_size = original_size * 0.6
-                compression_ratio = 40.0
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Original Size", f"{original_size:.2f} MB")
-                with col2:
-                    st.metric("Simulated Size", f"{simulated_compressed_size:.2f} MB")
-                with col3:
-                    st.metric("Simulated Reduction", f"{compression_ratio:.1f}%")
-                
-                st.info("🧪 This is demo mode. Install FFmpeg for actual video compression.")
-                
-            else:
-                progress_bar.progress(30)
-                status_text.text("⚙️ Compressing video...")
-                
-                process = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                    universal_newlines=True
-                )
-                stdout, stderr = process.communicate()
-                
-                progress_bar.progress(90)
-                
-                if process.returncode != 0:
-                    st.error("❌ Error during compression:")
-                    st.code(stderr, language="text")
-                elif not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
-                    st.error("❌ Output file was not created successfully")
-                else:
-                    progress_bar.progress(100)
-                    status_text.text("✅ Compression completed!")
-                    
-                    original_size = uploaded.size / 1024 / 1024
-                    compressed_size = os.path.getsize(out_path) / 1024 / 1024
-                    compression_ratio = (1 - compressed_size / original_size) * 100
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Original Size", f"{original_size:.2f} MB")
-                    with col2:
-                        st.metric("Compressed Size", f"{compressed_size:.2f} MB")
-                    with col3:
-                        st.metric("Size Reduction", f"{compression_ratio:.1f}%")
-                    
-                    with open(out_path, "rb") as f:
-                        st.download_button(
-                            label="⬇️ Download Compressed Video",
-                            data=f.read(),
-                            file_name=f"compressed_{uploaded.name}",
-                            mime="video/mp4",
-                            type="primary"
-                        )
-    
-    except Exception as e:
-        st.error(f"❌ Unexpected error: {str(e)}")
-    
-    finally:
-        try:
-            if 'in_path' in locals() and os.path.exists(in_path):
-                os.remove(in_path)
-            if 'out_path' in locals() and os.path.exists(out_path):
-                os.remove(out_path)
-        except:
-            pass
-        
-        if 'progress_bar' in locals():
-            progress_bar.empty()
-        if 'status_text' in locals():
-            status_text.empty()
-
-if uploaded is not None:
-    with st.expander("💡 Usage Tips"):
-        st.markdown("""
-        **For best results:**
-        - **High Quality**: Use CRF 18-23 for minimal quality loss
-        - **Balanced**: Use CRF 23-28 for good quality and reasonable size
-        - **Small Size**: Use CRF 28-35 for maximum compression
-        
-        **Resolution tips:**
-        - Keep original for high-quality content
-        - Use 1080p for most web content
-        - Use 720p or 480p for social media or mobile viewing
-        
-        **Codec comparison:**
-        - **H.264 (libx264)**: Faster encoding, good compatibility
-        - **H.265 (libx265)**: Better compression, slower encoding
-        """)
-        
-st.markdown("---")
-st.markdown("*Powered by FFmpeg • Built with Streamlit*")
+import streamlit as st
+import asyncio
+import collections
+import hashlib
+import multiprocessing
+import signal
+import tempfile
+import threading
+import time
+import subprocess
+import shutil
+import os
+from uuid import uuid4
+
+# Copy uploads/downloads in bounded chunks instead of materializing whole files
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# FFmpeg executable; deployments (e.g. the Docker image) can point this at a
+# specific build instead of whatever happens to be first on PATH
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+
+# Keys emitted by FFmpeg's machine-readable -progress stream (kept apart
+# from real log lines; stdout carries the muxed video, so progress rides
+# on stderr alongside the log). Kept as bytes: the stream is parsed
+# undecoded and only real log lines are decoded, on the error path.
+PROGRESS_FIELDS = frozenset([
+    b"frame", b"fps", b"bitrate", b"total_size", b"out_time_us", b"out_time_ms",
+    b"out_time", b"dup_frames", b"drop_frames", b"speed", b"progress",
+])
+
+# Quality preset → (CRF, audio bitrate, encoder preset); module-level so the
+# per-rerun widget code just indexes instead of rebuilding the mapping
+QUALITY_PRESETS = {
+    "Custom": (23, "128k", "veryfast"),
+    "High Quality": (20, "192k", "slow"),
+    "Balanced": (23, "128k", "medium"),
+    "Small Size": (28, "96k", "veryfast"),
+}
+
+AUDIO_BITRATES = ("192k", "128k", "96k", "64k")
+
+ENCODER_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast",
+                   "medium", "slow", "slower")
+
+# Configure Streamlit
+st.set_page_config(
+    page_title="Video Shrinker",
+    layout="centered"
+)
+
+
+# Known Windows install locations, tried when ffmpeg is not on PATH
+COMMON_FFMPEG_PATHS = [
+    r"C:\Users\rannandale\OneDrive\Coding\video-shrinker\ffmpeg-master-latest-win64-gpl\bin\ffmpeg.exe",
+    r"C:\ffmpeg\bin\ffmpeg.exe",
+]
+
+
+@st.cache_resource
+def find_ffmpeg():
+    """Locate the FFmpeg executable once per session.
+
+    shutil.which walks PATH (with the proper PATHEXT rules on Windows,
+    so a separate ffmpeg.exe lookup is unnecessary); the known install
+    locations are only tried as a fallback. Cached so widget reruns
+    don't repeat the lookup.
+    """
+    for candidate in [FFMPEG_BIN] + COMMON_FFMPEG_PATHS:
+        found = shutil.which(candidate)
+        if found:
+            return found
+    return None
+
+
+def detect_ffmpeg():
+    """Resolve the FFmpeg path and version banner with a single -version run."""
+    path = find_ffmpeg()
+    if path is None:
+        return None, None
+    result = subprocess.run([path, "-version"], capture_output=True, text=True)
+    return path, result.stdout.split('\n')[0]
+
+
+# Hardware H.264/HEVC encoders worth offering when the build ships them.
+# VAAPI is deliberately left out: it needs device/hwupload plumbing that
+# this command builder doesn't do.
+HW_ENCODER_CANDIDATES = (
+    "h264_nvenc", "hevc_nvenc",
+    "h264_qsv", "hevc_qsv",
+    "h264_videotoolbox", "hevc_videotoolbox",
+)
+
+
+@st.cache_resource
+def detect_encoders():
+    """Return the hardware H.264/HEVC encoders that actually work here.
+
+    `-encoders` only reflects what was compiled in — stock builds list
+    h264_nvenc even on hosts with no GPU or driver — so each candidate
+    gets a one-frame test encode to the null muxer before it is offered.
+    Cached per session; the probes cost a few hundred ms once.
+    """
+    # use the resolved path so the fallback install locations work too
+    ffmpeg_bin = find_ffmpeg() or FFMPEG_BIN
+    try:
+        result = subprocess.run(
+            [ffmpeg_bin, "-hide_banner", "-encoders"],
+            capture_output=True, check=True, text=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return []
+    usable = []
+    for name in HW_ENCODER_CANDIDATES:
+        if name not in result.stdout:
+            continue
+        probe = subprocess.run(
+            [ffmpeg_bin, "-hide_banner", "-f", "lavfi",
+             "-i", "nullsrc=s=256x256:d=0.1", "-frames:v", "1",
+             "-c:v", name, "-f", "null", os.devnull],
+            capture_output=True
+        )
+        if probe.returncode == 0:
+            usable.append(name)
+    return usable
+
+
+def probe_audio(path):
+    """Return (codec_name, bit_rate) of the first audio stream, or (None, 0).
+
+    Not cached: staged paths carry a fresh uuid per upload, so a
+    path-keyed st.cache_data could never hit and only accumulated stale
+    entries. The probe itself is a few milliseconds of ffprobe on a
+    local file, run once per staged input.
+    """
+    try:
+        out = subprocess.check_output(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0",
+             "-show_entries", "stream=codec_name,bit_rate",
+             "-of", "default=noprint_wrappers=1", path],
+            text=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None, 0
+    codec, bit_rate = None, 0
+    for line in out.splitlines():
+        key, _, value = line.partition("=")
+        if key == "codec_name":
+            codec = value
+        elif key == "bit_rate":
+            try:
+                bit_rate = int(value)
+            except ValueError:
+                pass
+    return codec, bit_rate
+
+
+def should_copy_audio(path, audio_bitrate):
+    """True when the source audio is already AAC at or below the target bitrate.
+
+    Re-encoding AAC to an equal or higher bitrate cannot make the file
+    smaller — it just burns an encode pass and loses a generation of
+    quality — so the caller switches to -c:a copy. A 10% margin keeps
+    the copy for sources sitting marginally above the target.
+    """
+    codec, bit_rate = probe_audio(path)
+    if codec != "aac" or not bit_rate:
+        return False
+    target = int(audio_bitrate.rstrip("k")) * 1000
+    return bit_rate <= target * 1.10
+
+
+def probe_duration(path):
+    """Return the media duration in seconds via ffprobe, or 0.0 if unknown."""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, check=True, text=True
+        ).stdout.strip()
+        return float(out)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return 0.0
+
+
+async def _run_ffmpeg_async(cmd, duration, progress_bar, output=None, input_stream=None):
+    """Run FFmpeg without blocking, streaming its -progress output.
+
+    Reads stderr incrementally instead of buffering it all via
+    communicate(), keeping only a bounded ring of recent lines for the
+    error display. When output is given, stdout (the muxed video in
+    pipe mode) is drained into it in chunks; when input_stream is given,
+    it is fed to stdin in chunks (for pipe:0 inputs). The process id is
+    stashed in session state so a rerun (e.g. the Cancel button) can
+    terminate an in-flight encode. Returns (returncode, stderr_text,
+    bytes_written).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    st.session_state.ffmpeg_pid = process.pid
+    bytes_written = 0
+
+    async def feed_stdin():
+        try:
+            if input_stream is not None:
+                while True:
+                    # the upload/spool objects are synchronous; read/write them
+                    # off the event loop so progress parsing keeps running
+                    chunk = await asyncio.to_thread(input_stream.read, CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # FFmpeg exited early; its stderr explains why
+        finally:
+            process.stdin.close()
+
+    async def drain_stdout():
+        nonlocal bytes_written
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if output is not None:
+                await asyncio.to_thread(output.write, chunk)
+            bytes_written += len(chunk)
+
+    stdin_task = asyncio.ensure_future(feed_stdin())
+    stdout_task = asyncio.ensure_future(drain_stdout())
+    stderr_ring = collections.deque(maxlen=30)
+    unknown_tick = 0
+    while True:
+        # parse the stream as bytes; decoding every progress tick through a
+        # codec is wasted work when only error lines are ever displayed
+        raw = await process.stderr.readline()
+        if not raw:
+            break
+        key, sep, value = raw.rstrip(b"\n").partition(b"=")
+        if sep and (key in PROGRESS_FIELDS or key.endswith(b"_q")):
+            # -progress reports out_time_ms in microseconds despite the name
+            if key == b"out_time_ms":
+                try:
+                    out_time_s = int(value) / 1_000_000
+                except ValueError:
+                    continue
+                if duration > 0:
+                    progress_bar.progress(min(99, int(100 * out_time_s / duration)))
+                else:
+                    # unknown total (piped stdin): creep the bar anyway — these
+                    # Streamlit calls are also what lets a Cancel rerun
+                    # interrupt the blocked script mid-encode
+                    unknown_tick = min(99, unknown_tick + 1)
+                    progress_bar.progress(unknown_tick)
+            continue
+        stderr_ring.append(raw)
+    await stdin_task
+    await stdout_task
+    await process.wait()
+    st.session_state.pop("ffmpeg_pid", None)
+    stderr_text = b"".join(stderr_ring).decode("utf-8", errors="replace")
+    return process.returncode, stderr_text, bytes_written
+
+
+def run_ffmpeg_with_progress(cmd, duration, progress_bar, output=None, input_stream=None):
+    """Synchronous wrapper so the Streamlit script can call the async runner."""
+    return asyncio.run(_run_ffmpeg_async(cmd, duration, progress_bar, output, input_stream))
+
+
+# staged files older than this are swept from the workspace
+WORKDIR_MAX_AGE_S = 3600
+
+
+def _sweep_workdir(path):
+    """Periodically remove stale staging files left by crashed/abandoned runs."""
+    while True:
+        cutoff = time.time() - WORKDIR_MAX_AGE_S
+        for name in os.listdir(path):
+            full = os.path.join(path, name)
+            try:
+                if os.path.getmtime(full) < cutoff:
+                    os.remove(full)
+            except OSError:
+                pass
+        time.sleep(600)
+
+
+@st.cache_resource
+def workdir():
+    """Disk-backed workspace reused for staged inputs and outputs.
+
+    The system $TMPDIR is often a RAM-backed tmpfs on Linux, so gigabyte
+    staging files there double-charge memory. Default to /var/tmp, which
+    is disk-backed, overridable via VIDEOSHRINK_TMPDIR; a background
+    sweeper clears files older than an hour.
+    """
+    path = os.environ.get("VIDEOSHRINK_TMPDIR", "/var/tmp/videoshrinker")
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        path = tempfile.mkdtemp(prefix="videoshrinker_")
+    threading.Thread(target=_sweep_workdir, args=(path,), daemon=True).start()
+    return path
+
+
+@st.cache_resource
+def scratch_dir():
+    """RAM-backed directory for tiny, frequently re-read scratch files.
+
+    Two-pass stats files and per-job -progress files are a few KB but get
+    polled or rewritten constantly; /dev/shm keeps that churn off the
+    disk. Falls back to the disk-backed workspace where /dev/shm doesn't
+    exist. Gigabyte staging files stay in workdir().
+    """
+    if not os.path.isdir("/dev/shm"):
+        return workdir()
+    path = "/dev/shm/videoshrinker"
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return workdir()
+    threading.Thread(target=_sweep_workdir, args=(path,), daemon=True).start()
+    return path
+
+
+@st.cache_resource
+def encode_cache_dir():
+    """Directory for reusing outputs of repeat encodes with identical settings."""
+    path = os.path.join(workdir(), "cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# cached encodes beyond this total are evicted, least recently used first
+ENCODE_CACHE_MAX_BYTES = 4 * 1024 ** 3
+
+
+def evict_encode_cache(path, max_bytes=ENCODE_CACHE_MAX_BYTES):
+    """Shrink the encode cache to max_bytes by dropping the oldest entries.
+
+    Cache hits bump the entry's mtime, so mtime order is LRU order.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        try:
+            info = os.stat(full)
+        except OSError:
+            continue
+        entries.append((info.st_mtime, info.st_size, full))
+        total += info.st_size
+    entries.sort()
+    for _, size, full in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(full)
+            total -= size
+        except OSError:
+            pass
+
+
+def hash_fileobj(fileobj):
+    """Content hash of a seekable file-like object, in bounded chunks.
+
+    BLAKE2b at 16 bytes: collision-safe for cache keying and noticeably
+    faster than SHA-256 on large uploads.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    fileobj.seek(0)
+    while chunk := fileobj.read(CHUNK_SIZE):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class HashingReader:
+    """Tee wrapper that hashes bytes as they are read.
+
+    Wrapping the upload during the staging copy lets copyfileobj and the
+    cache-key hash share a single pass over the data instead of reading
+    the whole file twice.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._digest = hashlib.blake2b(digest_size=16)
+
+    def read(self, size=-1):
+        chunk = self._fileobj.read(size)
+        self._digest.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+@st.cache_resource
+def scale_npp_available():
+    """Check once per session whether this FFmpeg build ships the NPP GPU scaler."""
+    try:
+        result = subprocess.run(
+            [find_ffmpeg() or FFMPEG_BIN, "-hide_banner", "-filters"],
+            capture_output=True, check=True, text=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+    return "scale_npp" in result.stdout
+
+
+def compress_one(job):
+    """Pool worker: run one FFmpeg invocation for a staged input file.
+
+    Runs in a separate process, so it must not touch any Streamlit state.
+    Returns (returncode, stderr_tail).
+    """
+    # capture bytes; decode only the tail that might actually be shown
+    process = subprocess.run(job["cmd"], capture_output=True)
+    tail = b"\n".join(process.stderr.splitlines()[-30:])
+    return process.returncode, tail.decode("utf-8", errors="replace")
+
+
+def read_progress_percent(progress_path, duration):
+    """Return percent complete from an FFmpeg -progress file, or None."""
+    if duration <= 0:
+        return None
+    try:
+        with open(progress_path, "rb") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        if line.startswith(b"out_time_ms="):
+            try:
+                out_time_s = int(line.partition(b"=")[2]) / 1_000_000
+            except ValueError:
+                return None
+            return min(99, int(100 * out_time_s / duration))
+    return None
+
+
+def _nonempty(path):
+    """True if path exists and has content — one stat instead of exists+getsize."""
+    try:
+        return os.stat(path).st_size > 0
+    except OSError:
+        return False
+
+
+def build_ffmpeg_cmd(in_path, out_path, video_codec, crf_value, audio_bitrate,
+                     scale_width, framerate_limit, encoder_preset="medium",
+                     threads=None, progress_target="pipe:2", pipe_output=False,
+                     tune=None, copy_audio=False, fragmented=False,
+                     video_bitrate=None, pass_number=None, passlogfile=None,
+                     ffmpeg_bin=None):
+    """Build the FFmpeg argument tuple for a software or hardware encoder.
+
+    The CRF slider maps to each encoder's own quality knob (-crf, -cq,
+    -global_quality, -q:v). With pipe_output the muxer writes fragmented
+    MP4 to stdout instead of seeking around a temp file (out_path is
+    ignored). Setting video_bitrate switches the software encoders from
+    constant quality to ABR; pass_number/passlogfile drive the two-pass
+    target-size mode (pass 1 drops audio and muxes to the null sink).
+    Only called from the button handler, and the uuid-stamped paths make
+    every call unique anyway, so the result is deliberately not memoized.
+    """
+    # callers pass the path resolved by find_ffmpeg(); the env default only
+    # covers code paths that never exec the command (e.g. demo mode)
+    if ffmpeg_bin is None:
+        ffmpeg_bin = FFMPEG_BIN
+    use_nvenc = video_codec.endswith("_nvenc")
+    if use_nvenc:
+        cmd = [
+            ffmpeg_bin, "-y",
+            "-hwaccel", "cuda",
+            "-hwaccel_output_format", "cuda",
+            "-i", in_path,
+            "-c:v", video_codec,
+            "-preset", "p4",
+            "-tune", "hq",
+            "-bf", "2",
+            "-refs", "1",
+            "-rc", "vbr",
+            "-cq", str(crf_value)
+        ]
+    elif video_codec.endswith("_qsv"):
+        cmd = [
+            ffmpeg_bin, "-y", "-i", in_path,
+            "-c:v", video_codec,
+            "-global_quality", str(crf_value)
+        ]
+    elif video_codec.endswith("_videotoolbox"):
+        # VideoToolbox quality runs 1-100 with higher = better — the inverse
+        # of CRF — so map the slider's 15-35 range onto roughly q 85-40
+        vt_quality = max(1, min(100, round(85 - (crf_value - 15) * 2.25)))
+        cmd = [
+            ffmpeg_bin, "-y", "-i", in_path,
+            "-c:v", video_codec,
+            "-q:v", str(vt_quality)
+        ]
+    else:
+        cmd = [
+            ffmpeg_bin, "-y", "-i", in_path,
+            "-vcodec", video_codec,
+            "-preset", encoder_preset,
+            # 0 = let the encoder size its own thread pool
+            "-threads", str(threads if threads else 0),
+        ]
+        if video_bitrate is None:
+            cmd += ["-crf", str(crf_value)]
+        if video_codec == "libx265":
+            # x265 additionally wants its NUMA pools opened up explicitly.
+            # FFmpeg's libx265 wrapper ignores the generic -pass/-passlogfile
+            # flags, so two-pass state has to travel as x265 params too.
+            x265_params = "pools=+"
+            if pass_number:
+                x265_params += f":pass={pass_number}:stats={passlogfile}"
+            cmd += ["-x265-params", x265_params]
+        if tune and video_codec == "libx265" and tune in ("film", "stillimage"):
+            # x264-only tunes would fail x265 param init; drop rather than abort
+            tune = None
+        if tune:
+            # x264/x265 only; the hardware encoders have their own vocabulary
+            cmd += ["-tune", tune]
+
+    if video_bitrate:
+        cmd += ["-b:v", video_bitrate]
+    if pass_number and video_codec != "libx265":
+        cmd += ["-pass", str(pass_number), "-passlogfile", passlogfile]
+
+    # deliberately no '-map 0'/'-c:s copy': MKV/WebM subtitle codecs don't
+    # stream-copy into (fragmented) MP4 and would fail the whole encode, so
+    # FFmpeg's default best-video+best-audio selection stands
+    if pass_number == 1:
+        # analysis pass: the stats file is the only output worth keeping
+        cmd += ["-an"]
+    elif copy_audio:
+        cmd += ["-c:a", "copy"]
+    else:
+        cmd += ["-c:a", "aac", "-b:a", audio_bitrate]
+    cmd += [
+        "-progress", progress_target,
+        "-nostats"
+    ]
+
+    video_filters = []
+    # cap the frame rate before scaling so dropped frames never get scaled
+    # first; the old 'min(N,source_fps)' string was not a valid fps argument
+    if framerate_limit and framerate_limit > 0:
+        video_filters.append(f"fps=fps={framerate_limit}")
+    if scale_width and scale_width > 0:
+        # scale_npp/scale_cuda keep frames in GPU memory end-to-end on the NVENC path
+        if use_nvenc and scale_npp_available():
+            video_filters.append(
+                f"scale_npp=w='min({scale_width}\\,iw)':h=-2:interp_algo=lanczos"
+            )
+        elif use_nvenc:
+            video_filters.append(f"scale_cuda='min({scale_width},iw)':'-2'")
+        else:
+            # fast_bilinear is 2-3x cheaper than the bicubic default and
+            # indistinguishable at downscale-for-web quality levels
+            video_filters.append(
+                f"scale=w='min({scale_width}\\,iw)':h=-2:flags=fast_bilinear"
+            )
+
+    if video_filters:
+        cmd += ["-vf", ",".join(video_filters)]
+
+    if pass_number == 1:
+        cmd += ["-f", "null", os.devnull]
+    elif pipe_output:
+        # +faststart needs seekable output; fragmented MP4 muxes straight to a pipe
+        cmd += ["-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+                "-frag_duration", "2000000", "-f", "mp4", "pipe:1"]
+    elif fragmented:
+        # skips the moov-relocation pass (a full re-read/re-write of the output)
+        cmd += ["-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+                "-frag_duration", "2000000", out_path]
+    else:
+        cmd += ["-movflags", "+faststart", out_path]
+    return tuple(cmd)
+
+st.title("📹 Video Shrinker (using FFmpeg)")
+st.markdown("Upload a video (up to 1GB), choose compression settings, and download a smaller version.")
+
+# A rerun while an encode is in flight (e.g. the Cancel button) arrives here
+# with the old FFmpeg process still running — terminate it before anything else.
+if "ffmpeg_pid" in st.session_state:
+    try:
+        os.kill(st.session_state.ffmpeg_pid, signal.SIGTERM)
+    except OSError:
+        pass
+    del st.session_state["ffmpeg_pid"]
+
+uploaded_files = st.file_uploader(
+    "Upload video files (Max: 1GB each)",
+    type=["mp4", "mov", "avi", "mkv", "webm", "flv", "wmv", "m4v"],
+    accept_multiple_files=True,
+    help="Supported formats: MP4, MOV, AVI, MKV, WebM, FLV, WMV, M4V"
+)
+uploaded = uploaded_files[0] if uploaded_files else None
+
+if uploaded_files:
+    for uploaded_file in uploaded_files:
+        file_size_mb = uploaded_file.size / (1 << 20)
+        st.write(f"**{uploaded_file.name}** ({uploaded_file.type}) — {file_size_mb:.2f} MB")
+
+    if any(f.size > 500 * (1 << 20) for f in uploaded_files):
+        st.warning("⚠️ Large file detected. Compression may take several minutes.")
+
+    st.sidebar.header("🎛️ Compression Settings")
+
+    workspace_free_gb = shutil.disk_usage(workdir()).free / (1024 ** 3)
+    st.sidebar.metric("💾 Workspace Free", f"{workspace_free_gb:.1f} GB")
+
+    quality_preset = st.sidebar.selectbox(
+        "Quality Preset",
+        options=list(QUALITY_PRESETS),
+        index=2,
+        help="Quick presets for common use cases"
+    )
+
+    default_crf, default_audio, default_preset = QUALITY_PRESETS[quality_preset]
+
+    crf_value = st.sidebar.slider(
+        "CRF (Constant Rate Factor)",
+        min_value=15, max_value=35, value=default_crf, step=1,
+        help="Lower CRF = higher quality but larger file. Higher CRF = smaller file but lower quality."
+    )
+
+    encoder_preset = st.sidebar.selectbox(
+        "Encoder Preset",
+        options=list(ENCODER_PRESETS),
+        index=ENCODER_PRESETS.index(default_preset),
+        help="Faster presets encode quicker but produce slightly larger files at the same CRF."
+    )
+    
+    resolution_option = st.sidebar.selectbox(
+        "Resolution",
+        options=["Keep Original", "1920x1080 (1080p)", "1280x720 (720p)", "854x480 (480p)", "Custom"],
+        index=0
+    )
+    
+    scale_width = 0
+    if resolution_option == "1920x1080 (1080p)":
+        scale_width = 1920
+    elif resolution_option == "1280x720 (720p)":
+        scale_width = 1280
+    elif resolution_option == "854x480 (480p)":
+        scale_width = 854
+    elif resolution_option == "Custom":
+        scale_width = st.sidebar.number_input(
+            "Max width (px)", min_value=0, value=0, step=100,
+            help="Leave 0 to keep original resolution."
+        )
+    
+    audio_bitrate = st.sidebar.selectbox(
+        "Audio Bitrate",
+        options=list(AUDIO_BITRATES),
+        index=AUDIO_BITRATES.index(default_audio),
+        help="Lower audio bitrate reduces file size but may affect audio quality."
+    )
+
+    target_size_mb = 0
+    if st.sidebar.checkbox(
+        "🎯 Target a specific size",
+        help="Switches to a two-pass bitrate encode sized to hit the target. "
+             "Roughly doubles the encode time but lands within a few percent "
+             "of the requested size, where CRF can overshoot by 15-25%."
+    ):
+        target_size_mb = st.sidebar.number_input(
+            "Target size (MB)", min_value=1, value=25, step=5
+        )
+
+    with st.sidebar.expander("🔧 Advanced Options"):
+        # hardware encoders (NVENC/QSV/VideoToolbox) go first when available,
+        # so they become the default pick on capable machines
+        codec_options = detect_encoders() + ["libx264", "libx265"]
+        video_codec = st.selectbox(
+            "Video Codec",
+            options=codec_options,
+            index=0,
+            help="Hardware encoders are an order of magnitude faster; H.265 (libx265) provides better compression but slower encoding"
+        )
+        hardware_codec = video_codec not in ("libx264", "libx265")
+
+        # film/stillimage are x264-only; x265 aborts param init on them, and
+        # HEVC picks can end up on libx265 (target-size mode, hw fallback)
+        if video_codec == "libx265" or "hevc" in video_codec:
+            tune_choices = ["(none)", "animation", "grain", "fastdecode", "zerolatency"]
+        else:
+            tune_choices = ["(none)", "film", "animation", "grain", "stillimage",
+                            "fastdecode", "zerolatency"]
+        tune_option = st.selectbox(
+            "Tune",
+            options=tune_choices,
+            index=0,
+            help="Match the encoder to the content type. zerolatency disables lookahead/B-frames for the fastest turnaround."
+        )
+        encoder_tune = None if tune_option == "(none)" else tune_option
+
+        # fragmented MP4 is the default: +faststart re-reads and rewrites the
+        # whole output just to move the moov atom to the front, and every
+        # modern browser plays fMP4 without it. Single-file encodes mux
+        # straight to a pipe, which can't seek for +faststart, so the toggle
+        # only exists for batch runs rather than sitting there as a no-op.
+        if len(uploaded_files) > 1:
+            legacy_mp4 = st.checkbox(
+                "Optimize for legacy players (+faststart)",
+                value=False,
+                help="Writes a classic non-fragmented MP4 with the moov atom relocated to the front. Costs a full re-read/re-write of the output after encoding; only needed for old hardware players."
+            )
+            streaming_mp4 = not legacy_mp4
+        else:
+            st.caption("Single files are streamed as fragmented MP4 "
+                       "(playable in all modern browsers).")
+            streaming_mp4 = True
+        
+        framerate_limit = st.number_input(
+            "Max Frame Rate (fps)",
+            min_value=0, max_value=60, value=0, step=1,
+            help="Leave 0 to keep original framerate"
+        )
+
+if uploaded_files and st.button("🚀 Compress Video", type="primary"):
+    # probe once per session; only re-check if FFmpeg was previously missing
+    if st.session_state.get("ffmpeg_info", (None, None))[0] is None:
+        st.session_state.ffmpeg_info = detect_ffmpeg()
+    ffmpeg_bin, ffmpeg_version = st.session_state.ffmpeg_info
+
+    if ffmpeg_bin is not None:
+        st.success("✅ FFmpeg detected successfully!")
+        st.write("FFmpeg version:", ffmpeg_version)
+    else:
+        st.error("❌ FFmpeg is not installed or not found in system PATH.")
+
+        st.write("**Debug Info:**")
+        st.write("Checked PATH and these locations:")
+        for path in COMMON_FFMPEG_PATHS:
+            st.write(f"❌ Not found at: {path}")
+
+        st.info("""
+        **Quick fixes to try:**
+        
+        1. **Restart Streamlit completely:**
+           - Stop the app (Ctrl+C)
+           - Close terminal
+           - Open new Command Prompt
+           - Run: `streamlit run app.py`
+        
+        2. **Try running from the directory where ffmpeg.exe is located**
+        
+        3. **Use absolute path test:**
+           - Run: `C:\\Users\\rannandale\\OneDrive\\Coding\\video-shrinker\\ffmpeg-master-latest-win64-gpl\\bin\\ffmpeg.exe -version`
+        """)
+        
+        demo_mode = st.checkbox("🧪 Enable Demo Mode (simulates compression without FFmpeg)")
+        if not demo_mode:
+            st.stop()
+
+    if len(uploaded_files) > 1:
+        st.write(f"⚙️ Compressing {len(uploaded_files)} videos in parallel...")
+        jobs = []
+        try:
+            for uploaded_file in uploaded_files:
+                input_suffix = os.path.splitext(uploaded_file.name)[1] or '.mp4'
+                slot = uuid4().hex
+                in_path = os.path.join(workdir(), f"in_{slot}{input_suffix}")
+                with open(in_path, "wb") as in_tmp:
+                    uploaded_file.seek(0)
+                    shutil.copyfileobj(uploaded_file, in_tmp, length=CHUNK_SIZE)
+
+                out_path = os.path.join(workdir(), f"out_{slot}.mp4")
+
+                # polled twice a second; keep it on the RAM-backed path
+                progress_path = os.path.join(scratch_dir(), f"progress_{slot}")
+                jobs.append({
+                    "name": uploaded_file.name,
+                    "slot": slot,
+                    "size": uploaded_file.size,
+                    "in_path": in_path,
+                    "out_path": out_path,
+                    "progress_path": progress_path,
+                    "duration": probe_duration(in_path),
+                    # cap each job at 2 encoder threads to avoid oversubscription
+                    "cmd": build_ffmpeg_cmd(
+                        in_path, out_path, video_codec, crf_value, audio_bitrate,
+                        scale_width, framerate_limit, encoder_preset,
+                        threads=2, progress_target=progress_path, tune=encoder_tune,
+                        copy_audio=should_copy_audio(in_path, audio_bitrate),
+                        fragmented=streaming_mp4, ffmpeg_bin=ffmpeg_bin
+                    ),
+                })
+
+            progress_rows = [(st.progress(0), st.empty()) for _ in jobs]
+            for (bar, label), job in zip(progress_rows, jobs):
+                label.text(f"⚙️ {job['name']}")
+
+            # each x264 job spawns its own threads, so use only half the cores
+            workers = min(len(jobs), max(1, os.cpu_count() // 2))
+            with multiprocessing.Pool(processes=workers) as pool:
+                async_result = pool.map_async(compress_one, jobs)
+                while not async_result.ready():
+                    for (bar, label), job in zip(progress_rows, jobs):
+                        percent = read_progress_percent(job["progress_path"], job["duration"])
+                        if percent is not None:
+                            bar.progress(percent)
+                    async_result.wait(0.5)
+                results = async_result.get()
+
+            for (bar, label), job, (returncode, stderr) in zip(progress_rows, jobs, results):
+                try:
+                    compressed_bytes = os.path.getsize(job["out_path"])
+                except OSError:
+                    compressed_bytes = 0
+                if returncode != 0 or compressed_bytes == 0:
+                    bar.empty()
+                    label.text(f"❌ {job['name']}: compression failed")
+                    st.code(stderr, language="text")
+                    continue
+
+                bar.progress(100)
+                original_size = job["size"] / (1 << 20)
+                compressed_size = compressed_bytes / (1 << 20)
+                label.text(f"✅ {job['name']}: {original_size:.2f} MB → {compressed_size:.2f} MB")
+
+                # download_button copies the payload into the media manager
+                # at widget creation, so a short-lived rb handle is all it needs
+                with open(job["out_path"], "rb") as out_f:
+                    st.download_button(
+                        label=f"⬇️ Download compressed_{job['name']}",
+                        data=out_f,
+                        file_name=f"compressed_{job['name']}",
+                        mime="video/mp4",
+                        # keyed on the job slot: two uploads may share a filename
+                        key=f"download_{job['slot']}"
+                    )
+
+        except Exception as e:
+            st.error(f"❌ Unexpected error: {str(e)}")
+
+        finally:
+            for job in jobs:
+                for path in (job["in_path"], job["out_path"], job["progress_path"]):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+        st.stop()
+
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    original_size_mb = uploaded.size / (1 << 20)
+
+
+    try:
+        input_suffix = os.path.splitext(uploaded.name)[1] or '.mp4'
+        # MP4/MOV/M4V (and AVI's trailing index) need seekable input;
+        # stream-friendly containers go straight to FFmpeg's stdin with no
+        # temp-file round trip. Two-pass reads the input twice, so the
+        # target-size mode always stages to disk.
+        pipe_input = (
+            input_suffix.lower() in (".mkv", ".webm", ".ts", ".flv")
+            and not target_size_mb
+        )
+
+        if pipe_input:
+            # no staging pass to piggyback on; hashed lazily at cache time
+            content_hash = None
+            in_path = "pipe:0"
+        else:
+            in_path = os.path.join(workdir(), f"in_{uuid4().hex}{input_suffix}")
+            uploaded.seek(0)
+            hashing_upload = HashingReader(uploaded)
+            with open(in_path, "wb") as in_tmp:
+                shutil.copyfileobj(hashing_upload, in_tmp, length=CHUNK_SIZE)
+            content_hash = hashing_upload.hexdigest()
+
+        if not pipe_input and not _nonempty(in_path):
+            st.error("❌ Failed to create temporary input file")
+        else:
+            status_text.text("🔄 Starting compression...")
+            progress_bar.progress(10)
+
+            # needs a probe-able file, so piped inputs always re-encode audio;
+            # the target-size budget assumes the selected audio bitrate, so
+            # that mode re-encodes audio too
+            copy_audio = (
+                not pipe_input and not target_size_mb
+                and should_copy_audio(in_path, audio_bitrate)
+            )
+            if copy_audio:
+                st.info("🎵 Source audio is already AAC at the target bitrate — copying it without re-encoding.")
+
+            cmd = build_ffmpeg_cmd(
+                in_path, None, video_codec, crf_value, audio_bitrate,
+                scale_width, framerate_limit, encoder_preset,
+                pipe_output=True, tune=encoder_tune, copy_audio=copy_audio,
+                ffmpeg_bin=ffmpeg_bin
+            )
+
+            if 'demo_mode' in locals() and demo_mode:
+                progress_bar.progress(50)
+                status_text.text("🧪 Demo mode: Simulating compression...")
+                import time
+                time.sleep(2)
+
+                progress_bar.progress(100)
+                status_text.text("✅ Demo compression completed!")
+                
+                original_size = original_size_mb
+                simulated_compressed_size = original_size * 0.6
+                compression_ratio = 40.0
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Original Size", f"{original_size:.2f} MB")
+                with col2:
+                    st.metric("Simulated Size", f"{simulated_compressed_size:.2f} MB")
+                with col3:
+                    st.metric("Simulated Reduction", f"{compression_ratio:.1f}%")
+                
+                st.info("🧪 This is demo mode. Install FFmpeg for actual video compression.")
+                
+            else:
+                status_text.text("⚙️ Compressing video...")
+                st.button("🛑 Cancel compression", help="Stops the running FFmpeg process")
+
+                # no duration for piped input — the bar then only moves on completion
+                duration = 0.0 if pipe_input else probe_duration(in_path)
+
+                two_pass_log = None
+                if target_size_mb and duration > 0:
+                    # container overhead and audio come off the top; video
+                    # gets whatever bitrate budget is left
+                    audio_kbps = int(audio_bitrate.rstrip("k"))
+                    video_kbps = max(
+                        100, int(target_size_mb * 8192 / duration) - audio_kbps
+                    )
+                    # -pass/-passlogfile only exist for the software encoders
+                    two_pass_codec = (
+                        "libx265" if "hevc" in video_codec or video_codec == "libx265"
+                        else "libx264"
+                    )
+                    # the stats file is small and re-read in full by pass 2
+                    two_pass_log = os.path.join(scratch_dir(), f"2pass_{uuid4().hex}")
+                    cmd = build_ffmpeg_cmd(
+                        in_path, None, two_pass_codec, crf_value, audio_bitrate,
+                        scale_width, framerate_limit, encoder_preset,
+                        pipe_output=True, tune=encoder_tune,
+                        video_bitrate=f"{video_kbps}k", pass_number=2,
+                        passlogfile=two_pass_log, ffmpeg_bin=ffmpeg_bin
+                    )
+                elif target_size_mb:
+                    st.warning("⚠️ Could not determine the video duration — "
+                               "falling back to single-pass CRF encoding.")
+                # stream the muxed output into the disk-backed workspace.
+                # download_button only accepts plain bytes/file handles (a
+                # SpooledTemporaryFile raises StreamlitAPIException) and it
+                # copies the payload into the media manager at widget
+                # creation anyway, so an in-memory spool buys nothing
+                out_path = os.path.join(workdir(), f"out_{uuid4().hex}.mp4")
+                out_file = open(out_path, "w+b")
+                download_source = None
+
+                settings_key = (
+                    f"{video_codec}-{crf_value}-{audio_bitrate}-{scale_width}"
+                    f"-{framerate_limit}-{encoder_preset}-{encoder_tune}"
+                    f"-{target_size_mb}"
+                )
+                if content_hash is None:
+                    content_hash = hash_fileobj(uploaded)
+                cache_path = os.path.join(
+                    encode_cache_dir(), f"{content_hash}-{settings_key}.mp4"
+                )
+
+                if _nonempty(cache_path):
+                    # same file, same settings — serve the previous encode
+                    # straight from the cache
+                    status_text.text("♻️ Reusing cached result...")
+                    os.utime(cache_path)  # mark as recently used for eviction
+                    download_source = open(cache_path, "rb")
+                    returncode, stderr = 0, ""
+                    out_bytes = os.stat(cache_path).st_size
+                else:
+                    returncode, out_bytes = 0, 0
+                    if two_pass_log:
+                        status_text.text("📊 Pass 1/2: analyzing bitrate distribution...")
+                        pass1_cmd = build_ffmpeg_cmd(
+                            in_path, None, two_pass_codec, crf_value,
+                            audio_bitrate, scale_width, framerate_limit,
+                            encoder_preset, tune=encoder_tune,
+                            video_bitrate=f"{video_kbps}k", pass_number=1,
+                            passlogfile=two_pass_log, ffmpeg_bin=ffmpeg_bin
+                        )
+                        returncode, stderr, _ = run_ffmpeg_with_progress(
+                            pass1_cmd, duration, progress_bar
+                        )
+                        status_text.text("⚙️ Pass 2/2: encoding to target size...")
+                    if returncode == 0:
+                        returncode, stderr, out_bytes = run_ffmpeg_with_progress(
+                            cmd, duration, progress_bar, out_file,
+                            input_stream=uploaded if pipe_input else None
+                        )
+
+                    if returncode != 0 and hardware_codec and not two_pass_log:
+                        st.warning("⚠️ Hardware encoding failed — falling back to software encoding.")
+                        out_file.seek(0)
+                        out_file.truncate()
+                        uploaded.seek(0)
+                        fallback_codec = "libx265" if "hevc" in video_codec else "libx264"
+                        cmd = build_ffmpeg_cmd(
+                            in_path, None, fallback_codec, crf_value, audio_bitrate,
+                            scale_width, framerate_limit, encoder_preset,
+                            pipe_output=True, tune=encoder_tune,
+                            copy_audio=copy_audio, ffmpeg_bin=ffmpeg_bin
+                        )
+                        returncode, stderr, out_bytes = run_ffmpeg_with_progress(
+                            cmd, duration, progress_bar, out_file,
+                            input_stream=uploaded if pipe_input else None
+                        )
+
+                    if returncode == 0 and out_bytes > 0:
+                        out_file.seek(0)
+                        with open(cache_path, "wb") as cached:
+                            shutil.copyfileobj(out_file, cached, length=CHUNK_SIZE)
+                        evict_encode_cache(encode_cache_dir())
+
+                if returncode != 0:
+                    st.error("❌ Error during compression:")
+                    st.code(stderr, language="text")
+                elif out_bytes == 0:
+                    st.error("❌ Output file was not created successfully")
+                else:
+                    progress_bar.progress(100)
+                    status_text.text("✅ Compression completed!")
+
+                    original_size = original_size_mb
+                    compressed_size = out_bytes / (1 << 20)
+                    compression_ratio = (1 - compressed_size / original_size) * 100
+
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Original Size", f"{original_size:.2f} MB")
+                    with col2:
+                        st.metric("Compressed Size", f"{compressed_size:.2f} MB")
+                    with col3:
+                        st.metric("Size Reduction", f"{compression_ratio:.1f}%")
+
+                    if download_source is None:
+                        # fresh rb handle: one of download_button's accepted types
+                        download_source = open(out_path, "rb")
+                    st.download_button(
+                        label="⬇️ Download Compressed Video",
+                        data=download_source,
+                        file_name=f"compressed_{uploaded.name}",
+                        mime="video/mp4",
+                        type="primary"
+                    )
+
+    except Exception as e:
+        st.error(f"❌ Unexpected error: {str(e)}")
+
+    finally:
+        if 'two_pass_log' in locals() and two_pass_log:
+            # x264 writes <log>-0.log(.mbtree); x265 writes <log>(.cutree)
+            for suffix in ("", ".cutree", "-0.log", "-0.log.mbtree"):
+                try:
+                    os.remove(two_pass_log + suffix)
+                except OSError:
+                    pass
+        if 'in_path' in locals() and in_path != "pipe:0":
+            try:
+                # os.remove raises FileNotFoundError itself; no stat needed
+                os.remove(in_path)
+            except OSError:
+                pass
+        try:
+            if 'out_file' in locals():
+                out_file.close()
+            if 'download_source' in locals() and download_source is not None:
+                download_source.close()
+        except:
+            pass
+        if 'out_file' in locals():
+            try:
+                os.remove(out_path)
+            except OSError:
+                pass
+
+        if 'progress_bar' in locals():
+            progress_bar.empty()
+        if 'status_text' in locals():
+            status_text.empty()
+
+if uploaded_files:
+    with st.expander("💡 Usage Tips"):
+        st.markdown("""
+        **For best results:**
+        - **High Quality**: Use CRF 18-23 for minimal quality loss
+        - **Balanced**: Use CRF 23-28 for good quality and reasonable size
+        - **Small Size**: Use CRF 28-35 for maximum compression
+        
+        **Resolution tips:**
+        - Keep original for high-quality content
+        - Use 1080p for most web content
+        - Use 720p or 480p for social media or mobile viewing
+        
+        **Codec comparison:**
+        - **H.264 (libx264)**: Faster encoding, good compatibility
+        - **H.265 (libx265)**: Better compression, slower encoding
+        """)
+        
+st.markdown("---")
+st.markdown("*Powered by FFmpeg • Built with Streamlit*")